@@ -11,6 +11,7 @@
 
 import json
 import logging
+from abc import abstractmethod
 from typing import Dict, Hashable, Mapping, Optional
 
 import numpy as np
@@ -21,7 +22,144 @@ logger = logging.getLogger(__name__)
 
 from monai.utils import optional_import
 
-distance_transform_cdt, _ = optional_import("scipy.ndimage.morphology", name="distance_transform_cdt")
+distance_transform_edt, _ = optional_import("scipy.ndimage", name="distance_transform_edt")
+edt, has_edt = optional_import("edt", name="edt")
+njit, has_numba = optional_import("numba", name="njit")
+cp, _ = optional_import("cupy")
+cupy_edt, has_cupy_edt = optional_import("cupyx.scipy.ndimage", name="distance_transform_edt")
+
+
+def _distance_transform(discrepancy, xp=np):
+    """
+    Per-channel Euclidean distance transform of a (C, H, W[, D]) discrepancy map, in voxels of the given map.
+    Uses the faster separable EDT from ``edt`` when available and scipy's otherwise, or CuPy's for ``xp=cupy``.
+    A channel without any background has no boundary to measure from; it gets a uniform distance of 1 on every
+    backend so its voxels are sampled uniformly.
+    """
+    distances = []
+    for c in discrepancy:
+        mask = c > 0
+        if bool(mask.all()):
+            distances.append(xp.ones(mask.shape, dtype=xp.float32))
+        elif xp is not np:
+            distances.append(cupy_edt(mask))
+        elif has_edt:
+            distances.append(edt(mask, parallel=0))
+        else:
+            distances.append(distance_transform_edt(mask))
+    return xp.stack(distances)
+
+
+def _discrepancy_sum(x):
+    # boolean maps are counted (popcount) rather than reduced as floats
+    return np.count_nonzero(x) if x.dtype == np.bool_ else float(x.sum())
+
+
+def _reduce_pos_neg_sum(pos, neg):
+    return _discrepancy_sum(pos), _discrepancy_sum(neg)
+
+
+def _gather_candidates_array(disc, wd):
+    # discrepancy maps are non-negative, so nonzero is the same as > 0 without the boolean temporary
+    idx = np.flatnonzero(disc)
+    return idx, wd[idx]
+
+
+if has_numba:
+
+    @njit(cache=True)
+    def _gather_candidates_numba(disc, wd):
+        # the nonzero scan and the gather in a single pass over the volume
+        idx = np.empty(disc.size, np.int64)
+        w = np.empty(disc.size, wd.dtype)
+        n = 0
+        for i in range(disc.size):
+            if disc[i] > 0:
+                idx[n] = i
+                w[n] = wd[i]
+                n += 1
+        return idx[:n], w[:n]
+
+    _gather_candidates = _gather_candidates_numba
+else:
+    _gather_candidates = _gather_candidates_array
+
+
+def _weighted_pick(disc, wd, u, xp=np):
+    """
+    Flat index of a voxel with ``disc > 0`` drawn with weight ``exp(wd) - 1`` for the uniform ``u`` in [0, 1),
+    or -1 if there is none.  ``xp`` is the array module of ``disc``/``wd`` (numpy or cupy).
+    """
+    if xp is np:
+        idx, w = _gather_candidates(disc, wd)
+    else:
+        idx = xp.flatnonzero(disc)
+        w = wd[idx]
+    if idx.size == 0:
+        return -1
+
+    m = w.max()
+    # (exp(w) - 1) * exp(-m): same distribution, but large distances can no longer overflow to inf
+    cum = xp.cumsum(xp.expm1(w - m) - xp.expm1(-m), dtype=xp.float64)
+    # use the cumsum's own total; a pairwise weights.sum() may exceed cum[-1] by a rounding error
+    total = float(cum[-1])
+    if total <= 0:
+        return -1
+    # cupy.searchsorted only takes array needles
+    return int(idx[min(int(xp.searchsorted(cum, xp.asarray(u * total), side="right")), idx.size - 1)])
+
+
+def _weighted_pick_cuda(discrepancy, weight_map, u, device):
+    """
+    ``_distance_transform`` and ``_weighted_pick`` on the GPU.  The discrepancy (and weight map) are copied to the
+    device on every call; only the picked index and its distance are copied back.
+    """
+    with cp.cuda.Device(int(device.partition(":")[2] or 0)):
+        disc = cp.asarray(discrepancy)
+        distance = _distance_transform(disc, xp=cp).astype(cp.float32, copy=False)
+        if weight_map is not None:
+            distance *= cp.asarray(weight_map)
+        wd_flat = distance.ravel()
+
+        seed = _weighted_pick(disc.ravel(), wd_flat, u, xp=cp)
+        return seed, (float(wd_flat[seed]) if seed >= 0 else None)
+
+
+def _sample_click(discrepancy, weight_map, downsample, rng, device="cpu"):
+    """
+    Sample a click within the discrepancy map with probability ``exp(distance) - 1``, where ``distance`` is the
+    (weighted) Euclidean distance to the discrepancy boundary.  Returns ``[distance, *coords]`` or ``None``.
+
+    When ``downsample > 1`` the distance is measured on the strided map, i.e. in units of ``downsample`` voxels;
+    the returned coordinates are full resolution.
+    """
+    if downsample > 1:
+        # stride the spatial dims only; the leading axis is the channel
+        stride = (slice(None),) + (slice(None, None, downsample),) * (discrepancy.ndim - 1)
+        if discrepancy[stride].any():
+            discrepancy = discrepancy[stride]
+            weight_map = weight_map[stride] if weight_map is not None else None
+        else:
+            # thin shells or single voxels can fall between the strided samples; use full resolution instead
+            downsample = 1
+
+    if device.startswith("cuda") and has_cupy_edt:
+        seed, dst = _weighted_pick_cuda(discrepancy, weight_map, rng.random(), device)
+    else:
+        distance = _distance_transform(discrepancy).astype(np.float32, copy=False)
+        if weight_map is not None:
+            np.multiply(distance, weight_map, out=distance)
+        disc_flat = discrepancy.ravel()
+        wd_flat = distance.ravel()
+
+        seed = _weighted_pick(disc_flat, wd_flat, rng.random())
+        dst = wd_flat[seed] if seed >= 0 else None
+    if seed < 0:
+        return None
+
+    # the channel coordinate is replaced by the distance of the click
+    coords = np.unravel_index(int(seed), discrepancy.shape)[1:]
+    return [float(dst)] + [int(c) * downsample for c in coords]
 
 
 class DiscardAddGuidanced(MapTransform):
@@ -44,16 +182,20 @@ class DiscardAddGuidanced(MapTransform):
         self.number_intensity_ch = number_intensity_ch
         self.discard_probability = probability
 
+        ignored = [key for key in self.keys if key != "image"]
+        if ignored:
+            logger.warning(f"This transform only applies to the image; ignoring keys: {ignored}")
+
     def _apply(self, image):
-        if self.discard_probability >= 1.0 or np.random.choice(
-            [True, False], p=[self.discard_probability, 1 - self.discard_probability]
-        ):
-            signal = np.zeros((1, image.shape[-3], image.shape[-2], image.shape[-1]), dtype=np.float32)
+        if self.discard_probability >= 1.0 or np.random.random() < self.discard_probability:
             if image.shape[0] == self.number_intensity_ch + 2:
-                image[self.number_intensity_ch] = signal
-                image[self.number_intensity_ch + 1] = signal
+                image[self.number_intensity_ch : self.number_intensity_ch + 2] = 0
             else:
-                image = np.concatenate((image, signal, signal), axis=0)
+                out = np.zeros(
+                    (self.number_intensity_ch + 2, image.shape[-3], image.shape[-2], image.shape[-1]), dtype=np.float32
+                )
+                out[: self.number_intensity_ch] = image[: self.number_intensity_ch]
+                image = out
         return image
 
     def __call__(self, data: Mapping[Hashable, np.ndarray]) -> Dict[Hashable, np.ndarray]:
@@ -61,8 +203,6 @@ class DiscardAddGuidanced(MapTransform):
         for key in self.key_iterator(d):
             if key == "image":
                 d[key] = self._apply(d[key])
-            else:
-                print("This transform only applies to the image")
         return d
 
 
@@ -79,31 +219,27 @@ class ResizeGuidanceCustomd(Transform):
         self.guidance = guidance
         self.ref_image = ref_image
 
+    @staticmethod
+    def _scale(clicks, factor):
+        if not len(clicks):
+            return []
+        return (np.asarray(clicks, dtype=np.float32) * factor).astype(np.int32).tolist()
+
     def __call__(self, data):
         d = dict(data)
-        current_shape = d[self.ref_image].shape[1:]
+        current_shape = np.asarray(d[self.ref_image].shape[1:], dtype=np.float32)
 
-        factor = np.divide(current_shape, d["image_meta_dict"]["dim"][1:4])
+        factor = current_shape / np.asarray(d["image_meta_dict"]["dim"][1:4], dtype=np.float32)
         pos_clicks, neg_clicks = d["foreground"], d["background"]
 
-        pos = np.multiply(pos_clicks, factor).astype(int).tolist() if len(pos_clicks) else []
-        neg = np.multiply(neg_clicks, factor).astype(int).tolist() if len(neg_clicks) else []
-
-        d[self.guidance] = [pos, neg]
+        d[self.guidance] = [self._scale(pos_clicks, factor), self._scale(neg_clicks, factor)]
         return d
 
 
-class AddRandomGuidanced(Randomizable, Transform):
+class _BaseRandomGuidance(Randomizable, Transform):
     """
-    Add random guidance based on discrepancies that were found between label and prediction.
-
-    Args:
-        guidance: key to guidance source, shape (2, N, # of dim)
-        discrepancy: key to discrepancy map between label and prediction
-          shape (2, C, H, W, D) or (2, C, H, W)
-        probability: key to click/interaction probability, shape (1)
-        weight_map: optional key to predetermined weight map used to increase click likelihood
-          in higher weight areas shape (C, H, W, D) or (C, H, W)
+    Shared implementation of the random guidance transforms; subclasses decide the polarity of the click when both
+    the positive and the negative discrepancy are non-empty.
     """
 
     def __init__(
@@ -112,33 +248,37 @@ class AddRandomGuidanced(Randomizable, Transform):
         discrepancy: str = "discrepancy",
         weight_map: Optional[str] = None,
         probability: str = "probability",
+        downsample: int = 2,
+        device: str = "cpu",
     ):
+        if downsample < 1:
+            raise ValueError(f"downsample must be >= 1, got {downsample}")
         self.guidance = guidance
         self.discrepancy = discrepancy
         self.weight_map = weight_map
         self.probability = probability
+        self.downsample = downsample
+        self.device = device
+        if device.startswith("cuda") and not has_cupy_edt:
+            logger.warning(f"cupy is not available; sampling clicks on the cpu instead of {device}")
         self._will_interact = None
+        self._sentinels: Dict[int, tuple] = {}
         self.is_pos = False
         self.is_neg = False
 
     def randomize(self, data=None):
         probability = data[self.probability]
-        self._will_interact = self.R.choice([True, False], p=[probability, 1.0 - probability])
+        self._will_interact = probability >= 1.0 or bool(self.R.random() < probability)
 
     def find_guidance(self, discrepancy, weight_map):
-        distance = distance_transform_cdt(discrepancy)
-        weighted_distance = (distance * weight_map).flatten() if weight_map is not None else distance.flatten()
-        probability = np.exp(weighted_distance) - 1.0
-        idx = np.where(discrepancy.flatten() > 0)[0]
-
-        if np.sum(discrepancy > 0) > 0:
-            seed = self.R.choice(idx, size=1, p=probability[idx] / np.sum(probability[idx]))
-            dst = weighted_distance[seed]
-
-            g = np.asarray(np.unravel_index(seed, discrepancy.shape)).transpose().tolist()[0]
-            g[0] = dst[0]
-            return g
-        return None
+        return _sample_click(discrepancy, weight_map, self.downsample, self.R, self.device)
+
+    @abstractmethod
+    def _choose_polarity(self, pos_discr, neg_discr):
+        """
+        Whether to correct the positive discrepancy when both ``pos_discr`` and ``neg_discr`` are non-empty.
+        """
+        pass
 
     def add_guidance(self, discrepancy, weight_map, will_interact):
         if not will_interact:
@@ -147,31 +287,48 @@ class AddRandomGuidanced(Randomizable, Transform):
         pos_discr = discrepancy[0]
         neg_discr = discrepancy[1]
 
-        can_be_positive = np.sum(pos_discr) > 0
-        can_be_negative = np.sum(neg_discr) > 0
-
-        correct_pos = np.sum(pos_discr) >= np.sum(neg_discr)
+        # any() stops at the first nonzero voxel; the sums are left to the subclasses that need them
+        can_be_positive = pos_discr.any()
+        can_be_negative = neg_discr.any()
 
-        if correct_pos and can_be_positive:
+        if can_be_positive and not can_be_negative:
             return self.find_guidance(pos_discr, weight_map), None
 
-        if not correct_pos and can_be_negative:
+        if not can_be_positive and can_be_negative:
             return None, self.find_guidance(neg_discr, weight_map)
-        return None, None
+
+        if not (can_be_positive or can_be_negative):
+            return None, None
+
+        if self._choose_polarity(pos_discr, neg_discr):
+            return self.find_guidance(pos_discr, weight_map), None
+        return None, self.find_guidance(neg_discr, weight_map)
+
+    def _sentinel(self, n):
+        # immutable, so it can be shared across calls; json.dumps writes tuples as lists
+        sentinel = self._sentinels.get(n)
+        if sentinel is None:
+            sentinel = self._sentinels[n] = (-1,) * n
+        return sentinel
 
     def _apply(self, guidance, discrepancy, weight_map):
-        guidance = guidance.tolist() if isinstance(guidance, np.ndarray) else guidance
-        guidance = json.loads(guidance) if isinstance(guidance, str) else guidance
+        if isinstance(guidance, np.ndarray):
+            guidance = guidance.astype(np.int32, copy=False).tolist()
+        elif isinstance(guidance, str):
+            guidance = json.loads(guidance)
         pos, neg = self.add_guidance(discrepancy, weight_map, self._will_interact)
         if pos:
+            pos = [int(v) for v in pos]
             guidance[0].append(pos)
-            guidance[1].append([-1] * len(pos))
+            guidance[1].append(self._sentinel(len(pos)))
             self.is_pos = True
         if neg:
-            guidance[0].append([-1] * len(neg))
+            neg = [int(v) for v in neg]
+            guidance[0].append(self._sentinel(len(neg)))
             guidance[1].append(neg)
             self.is_neg = True
-        return json.dumps(np.asarray(guidance).astype(int).tolist())
+        # kept as a json string so ragged guidance survives list_data_collate in Interaction
+        return json.dumps(guidance)
 
     def __call__(self, data):
         d = dict(data)
@@ -187,7 +344,31 @@ class AddRandomGuidanced(Randomizable, Transform):
         return d
 
 
-class PosNegClickProbAddRandomGuidanced(Randomizable, Transform):
+class AddRandomGuidanced(_BaseRandomGuidance):
+    """
+    Add random guidance based on discrepancies that were found between label and prediction.
+
+    Args:
+        guidance: key to guidance source, shape (2, N, # of dim)
+        discrepancy: key to discrepancy map between label and prediction
+          shape (2, C, H, W, D) or (2, C, H, W)
+        probability: key to click/interaction probability, shape (1)
+        weight_map: optional key to predetermined weight map used to increase click likelihood
+          in higher weight areas shape (C, H, W, D) or (C, H, W)
+        downsample: spatial stride applied to the discrepancy (and weight map) before the distance transform;
+          distances are then in strided voxels, sampled clicks are mapped back to full resolution
+        device: device used for the distance transform and click sampling, e.g. "cpu" or "cuda:0"; requires cupy
+          for "cuda" and falls back to the cpu otherwise. The discrepancy (and weight map) are copied from the host
+          on every call; only the sampled click is copied back
+    """
+
+    def _choose_polarity(self, pos_discr, neg_discr):
+        # correct the larger discrepancy
+        sp, sn = _reduce_pos_neg_sum(pos_discr, neg_discr)
+        return sp >= sn
+
+
+class PosNegClickProbAddRandomGuidanced(_BaseRandomGuidance):
     """
     Add random guidance based on discrepancies that were found between label and prediction.
 
@@ -199,6 +380,11 @@ class PosNegClickProbAddRandomGuidanced(Randomizable, Transform):
           (probability of negative click will be 1 - pos_click_probability)
         weight_map: optional key to predetermined weight map used to increase click likelihood
           in higher weight areas shape (C, H, W, D) or (C, H, W)
+        downsample: spatial stride applied to the discrepancy (and weight map) before the distance transform;
+          distances are then in strided voxels, sampled clicks are mapped back to full resolution
+        device: device used for the distance transform and click sampling, e.g. "cpu" or "cuda:0"; requires cupy
+          for "cuda" and falls back to the cpu otherwise. The discrepancy (and weight map) are copied from the host
+          on every call; only the sampled click is copied back
     """
 
     def __init__(
@@ -208,89 +394,14 @@ class PosNegClickProbAddRandomGuidanced(Randomizable, Transform):
         probability: str = "probability",
         pos_click_probability: float = 0.5,
         weight_map: Optional[str] = None,
+        downsample: int = 2,
+        device: str = "cpu",
     ):
-        self.guidance = guidance
-        self.discrepancy = discrepancy
-        self.probability = probability
+        super().__init__(guidance, discrepancy, weight_map, probability, downsample, device)
         self.pos_click_probability = pos_click_probability
-        self.weight_map = weight_map
-        self._will_interact = None
-        self.is_pos = False
-        self.is_neg = False
 
-    def randomize(self, data=None):
-        probability = data[self.probability]
-        self._will_interact = self.R.choice([True, False], p=[probability, 1.0 - probability])
-
-    def find_guidance(self, discrepancy, weight_map):
-        distance = distance_transform_cdt(discrepancy)
-        weighted_distance = (distance * weight_map).flatten() if weight_map is not None else distance.flatten()
-        probability = np.exp(weighted_distance) - 1.0
-        idx = np.where(discrepancy.flatten() > 0)[0]
-
-        if np.sum(discrepancy > 0) > 0:
-            seed = self.R.choice(idx, size=1, p=probability[idx] / np.sum(probability[idx]))
-            dst = weighted_distance[seed]
-
-            g = np.asarray(np.unravel_index(seed, discrepancy.shape)).transpose().tolist()[0]
-            g[0] = dst[0]
-            return g
-        return None
-
-    def add_guidance(self, discrepancy, weight_map, will_interact):
-        if not will_interact:
-            return None, None
-
-        pos_discr = discrepancy[0]
-        neg_discr = discrepancy[1]
-
-        can_be_positive = np.sum(pos_discr) > 0
-        can_be_negative = np.sum(neg_discr) > 0
-
-        pos_prob = self.pos_click_probability
-        neg_prob = 1 - pos_prob
-
-        correct_pos = self.R.choice([True, False], p=[pos_prob, neg_prob])
-
-        if can_be_positive and not can_be_negative:
-            return self.find_guidance(pos_discr, weight_map), None
-
-        if not can_be_positive and can_be_negative:
-            return None, self.find_guidance(neg_discr, weight_map)
-
-        if correct_pos and can_be_positive:
-            return self.find_guidance(pos_discr, weight_map), None
-
-        if not correct_pos and can_be_negative:
-            return None, self.find_guidance(neg_discr, weight_map)
-        return None, None
-
-    def _apply(self, guidance, discrepancy, weight_map):
-        guidance = guidance.tolist() if isinstance(guidance, np.ndarray) else guidance
-        guidance = json.loads(guidance) if isinstance(guidance, str) else guidance
-        pos, neg = self.add_guidance(discrepancy, weight_map, self._will_interact)
-        if pos:
-            guidance[0].append(pos)
-            guidance[1].append([-1] * len(pos))
-            self.is_pos = True
-        if neg:
-            guidance[0].append([-1] * len(neg))
-            guidance[1].append(neg)
-            self.is_neg = True
-        return json.dumps(np.asarray(guidance).astype(int).tolist())
-
-    def __call__(self, data):
-        d = dict(data)
-        guidance = d[self.guidance]
-        discrepancy = d[self.discrepancy]
-        weight_map = d[self.weight_map] if self.weight_map is not None else None
-        self.randomize(data)
-        d[self.guidance] = self._apply(guidance, discrepancy, weight_map)
-        d["is_pos"] = self.is_pos
-        d["is_neg"] = self.is_neg
-        self.is_pos = False
-        self.is_neg = False
-        return d
+    def _choose_polarity(self, pos_discr, neg_discr):
+        return self.R.random() < self.pos_click_probability
 
 
 # A transform to get single modality and single label
@@ -309,14 +420,8 @@ class SingleLabelSingleModalityd(MapTransform):
                         f"Label {meta_data['filename_or_obj'].split('/')[-1]} has more than one mask - "
                         f"taking SINGLE mask ..."
                     )
-                    result = []
                     # label bigger than 0 is foreground
-                    result.append(d[key] > 0)
-                    # label 0 is background
-                    result.append(d[key] == 0)
-                    d[key] = np.stack(result, axis=0).astype(np.float32)
-
-                    d[key] = d[key][0, ...]
+                    d[key] = (d[key] > 0).astype(np.float32)
 
                     meta_data["pixdim"][4] = 0.0
                     meta_data["dim"][0] = 3
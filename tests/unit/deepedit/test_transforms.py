@@ -9,11 +9,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import unittest
 
 import numpy as np
 
-from monailabel.deepedit.transforms import DiscardAddGuidanced, ResizeGuidanceCustomd
+from monailabel.deepedit import transforms
+from monailabel.deepedit.transforms import (
+    AddRandomGuidanced,
+    DiscardAddGuidanced,
+    PosNegClickProbAddRandomGuidanced,
+    ResizeGuidanceCustomd,
+    SingleLabelSingleModalityd,
+)
 
 IMAGE = np.array([[[[1, 0, 2, 0, 1], [0, 1, 2, 1, 0], [2, 2, 3, 2, 2], [0, 1, 2, 1, 0], [1, 0, 2, 0, 1]]]])
 LABEL = np.array([[[[0, 0, 0, 0, 0], [0, 1, 0, 1, 0], [0, 0, 1, 0, 0], [0, 1, 0, 1, 0], [0, 0, 0, 0, 0]]]])
@@ -30,6 +38,10 @@ DATA_1 = {
 }
 
 
+def _guidance_data(discrepancy, **kwargs):
+    return {"guidance": json.dumps([[], []]), "discrepancy": discrepancy, "probability": 1.0, **kwargs}
+
+
 class MyTestCase(unittest.TestCase):
     def test_t1(self):
         DiscardAddGuidanced(keys="image")(DATA_1)
@@ -37,6 +49,251 @@ class MyTestCase(unittest.TestCase):
     def test_t2(self):
         ResizeGuidanceCustomd("label", "image")(DATA_1)
 
+    def test_random_guidance_on_discrepancy(self):
+        discrepancy = np.stack([LABEL, 1 - LABEL]).astype(np.float32)
+        t = AddRandomGuidanced()
+        t.set_random_state(seed=0)
+        for _ in range(5):
+            result = t(_guidance_data(discrepancy))
+            guidance = json.loads(result["guidance"])
+            # the negative discrepancy is larger, so it gets corrected
+            self.assertTrue(result["is_neg"])
+            self.assertEqual(guidance[0][-1], [-1, -1, -1, -1])
+            self.assertEqual(discrepancy[1][(0, *guidance[1][-1][1:])], 1)
+
+    def test_downsample_even_voxel(self):
+        discrepancy = np.zeros((2, 1, 5, 5, 5), dtype=np.float32)
+        discrepancy[0, 0, 2, 4, 2] = 1
+        t = AddRandomGuidanced(downsample=2)
+        t.set_random_state(seed=0)
+        guidance = json.loads(t(_guidance_data(discrepancy))["guidance"])
+        self.assertEqual(guidance[0][-1], [1, 2, 4, 2])
+        self.assertEqual(guidance[1][-1], [-1, -1, -1, -1])
+
+    def test_downsample_odd_voxel(self):
+        discrepancy = np.zeros((2, 1, 5, 5, 5), dtype=np.float32)
+        discrepancy[0, 0, 1, 3, 1] = 1
+        t = AddRandomGuidanced(downsample=2)
+        t.set_random_state(seed=0)
+        result = t(_guidance_data(discrepancy))
+        self.assertTrue(result["is_pos"])
+        self.assertEqual(json.loads(result["guidance"])[0][-1][1:], [1, 3, 1])
+
+    def test_downsample_invalid(self):
+        with self.assertRaises(ValueError):
+            AddRandomGuidanced(downsample=0)
+
+    def test_discrepancy_without_background(self):
+        discrepancy = np.ones((2, 1, 4, 4, 4), dtype=np.float32)
+        discrepancy[1] = 0
+        for downsample in (1, 2):
+            t = AddRandomGuidanced(downsample=downsample)
+            t.set_random_state(seed=0)
+            result = t(_guidance_data(discrepancy))
+            self.assertTrue(result["is_pos"])
+            self.assertEqual(json.loads(result["guidance"])[0][-1][0], 1)
+
+    @unittest.skipUnless(transforms.has_numba, "Requires numba")
+    def test_numba_matches_array(self):
+        rng = np.random.RandomState(0)
+        disc = (rng.random_sample(512) > 0.7).astype(np.float32)
+        wd = (rng.random_sample(512) * 5).astype(np.float32)
+        for d in (disc, np.zeros_like(disc)):
+            idx, w = transforms._gather_candidates_numba(d, wd)
+            expected_idx, expected_w = transforms._gather_candidates_array(d, wd)
+            np.testing.assert_array_equal(idx, expected_idx)
+            np.testing.assert_array_equal(w, expected_w)
+
+    def test_guidance_array_input(self):
+        discrepancy = np.stack([LABEL, 1 - LABEL]).astype(np.float32)
+        data = _guidance_data(discrepancy, guidance=np.array([[[1, 0, 2, 2]], [[-1, -1, -1, -1]]]))
+        t = AddRandomGuidanced(downsample=1)
+        t.set_random_state(seed=0)
+        guidance = json.loads(t(data)["guidance"])
+        self.assertEqual(guidance[0][0], [1, 0, 2, 2])
+        self.assertEqual(len(guidance[1]), 2)
+        self.assertTrue(all(isinstance(v, int) for click in guidance[1] for v in click))
+
+    def test_single_label_single_modality(self):
+        label = np.zeros((5, 5, 5), dtype=np.int16)
+        label[1, 1, 1], label[3, 3, 3] = 1, 2
+        image = np.stack([np.ones((5, 5, 5)), np.zeros((5, 5, 5))], axis=-1)
+        data = {
+            "image": image,
+            "label": label,
+            "image_meta_dict": {"filename_or_obj": "a/image.nii", "pixdim": [1] * 8, "dim": [4, 5, 5, 5, 2, 1, 1, 1]},
+            "label_meta_dict": {"filename_or_obj": "a/label.nii", "pixdim": [1] * 8, "dim": [4, 5, 5, 5, 1, 1, 1, 1]},
+        }
+        result = SingleLabelSingleModalityd(keys=("image", "label"))(data)
+        self.assertEqual(result["label"].dtype, np.float32)
+        np.testing.assert_array_equal(result["label"], (label > 0).astype(np.float32))
+        np.testing.assert_array_equal(result["image"], np.ones((5, 5, 5)))
+        for key in ("image_meta_dict", "label_meta_dict"):
+            self.assertEqual(result[key]["dim"][0], 3)
+            self.assertEqual(result[key]["pixdim"][4], 0.0)
+
+    def test_discard_preallocates_guidance(self):
+        image = np.arange(125, dtype=np.float32).reshape((1, 5, 5, 5))
+        result = DiscardAddGuidanced(keys="image")({"image": image})["image"]
+        self.assertEqual(result.shape, (3, 5, 5, 5))
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_array_equal(result[0], image[0])
+        self.assertFalse(result[1:].any())
+
+    def test_discard_zeroes_guidance_in_place(self):
+        image = np.ones((3, 5, 5, 5), dtype=np.float32)
+        result = DiscardAddGuidanced(keys="image")({"image": image})["image"]
+        self.assertIs(result, image)
+        self.assertTrue((result[0] == 1).all())
+        self.assertFalse(result[1:].any())
+
+        image = np.ones((3, 5, 5, 5), dtype=np.float32)
+        result = DiscardAddGuidanced(keys="image", probability=0.0)({"image": image})["image"]
+        self.assertTrue((result == 1).all())
+
+    def test_discard_warns_on_non_image_keys(self):
+        with self.assertLogs(transforms.logger.name, level="WARNING") as logs:
+            transform = DiscardAddGuidanced(keys=["image", "label"])
+        self.assertIn("label", logs.output[0])
+        label = np.ones((1, 2, 2, 2))
+        result = transform({"image": np.ones((1, 2, 2, 2)), "label": label})
+        self.assertIs(result["label"], label)
+
+    def test_pos_click_probability(self):
+        discrepancy = np.stack([LABEL, 1 - LABEL]).astype(np.float32)
+        for p in (0.0, 1.0):
+            t = PosNegClickProbAddRandomGuidanced(pos_click_probability=p)
+            t.set_random_state(seed=0)
+            for _ in range(5):
+                result = t(_guidance_data(discrepancy))
+                self.assertEqual(result["is_pos"], p == 1.0)
+                self.assertEqual(result["is_neg"], p == 0.0)
+
+        t = PosNegClickProbAddRandomGuidanced()
+        t.set_random_state(seed=0)
+        result = t(_guidance_data(discrepancy, probability=0.0))
+        self.assertFalse(result["is_pos"] or result["is_neg"])
+
+    def test_boolean_discrepancy(self):
+        discrepancy = np.stack([LABEL > 0, LABEL == 0])
+        self.assertEqual(transforms._reduce_pos_neg_sum(discrepancy[0], discrepancy[1]), (5, 20))
+        t = AddRandomGuidanced()
+        t.set_random_state(seed=0)
+        result = t(_guidance_data(discrepancy))
+        self.assertTrue(result["is_neg"])
+        self.assertTrue(discrepancy[1][(0, *json.loads(result["guidance"])[1][-1][1:])])
+
+    def test_weight_map_selects_voxel(self):
+        discrepancy = np.zeros((2, 1, 5, 5, 5), dtype=np.float32)
+        discrepancy[0, 0, 1:4, 1:4, 1:4] = 1
+        weight_map = np.zeros((1, 5, 5, 5), dtype=np.float32)
+        weight_map[0, 1, 2, 3] = 1
+        t = AddRandomGuidanced(weight_map="weight_map", downsample=1)
+        t.set_random_state(seed=0)
+        for _ in range(5):
+            guidance = json.loads(t(_guidance_data(discrepancy, weight_map=weight_map))["guidance"])
+            self.assertEqual(guidance[0][-1][1:], [1, 2, 3])
+        # the weight map is multiplied into the distance buffer, never the other way round
+        self.assertEqual(weight_map.sum(), 1)
+
+    def test_resize_guidance(self):
+        data = {
+            "image": np.zeros((1, 10, 20, 5)),
+            "image_meta_dict": {"dim": [3, 20, 20, 20]},
+            "foreground": [[10, 10, 10], [19, 3, 4]],
+            "background": [],
+        }
+        result = ResizeGuidanceCustomd("guidance", "image")(data)
+        self.assertEqual(result["guidance"], [[[5, 10, 2], [9, 3, 1]], []])
+
+    def test_large_weight_map(self):
+        discrepancy = np.zeros((2, 1, 5, 5, 5), dtype=np.float32)
+        discrepancy[0, 0, 1, 1, 1] = discrepancy[0, 0, 3, 3, 3] = 1
+        # exp(1000) overflows; both voxels are equally far from the boundary and must both be reachable
+        weight_map = np.full((1, 5, 5, 5), 1000.0, dtype=np.float32)
+        t = AddRandomGuidanced(weight_map="weight_map", downsample=1)
+        t.set_random_state(seed=0)
+        clicks = set()
+        for _ in range(20):
+            result = t(_guidance_data(discrepancy, weight_map=weight_map))
+            self.assertTrue(result["is_pos"])
+            click = json.loads(result["guidance"])[0][-1]
+            self.assertEqual(click[0], 1000)
+            clicks.add(tuple(click[1:]))
+        self.assertEqual(clicks, {(1, 1, 1), (3, 3, 3)})
+
+    def test_zero_weight_map(self):
+        discrepancy = np.zeros((1, 5, 5, 5), dtype=np.float32)
+        discrepancy[0, 1:4, 1:4, 1:4] = 1
+        t = AddRandomGuidanced(weight_map="weight_map", downsample=1)
+        t.set_random_state(seed=0)
+        self.assertIsNone(t.find_guidance(discrepancy, np.zeros_like(discrepancy)))
+
+    @unittest.skipUnless(transforms.has_cupy_edt, "Requires cupy")
+    def test_cuda_matches_cpu(self):
+        disc = (1 - LABEL).astype(np.float32)
+        for seed in range(5):
+            cpu = transforms._sample_click(disc, None, 1, np.random.RandomState(seed), "cpu")
+            cuda = transforms._sample_click(disc, None, 1, np.random.RandomState(seed), "cuda")
+            self.assertEqual(cpu, cuda)
+
+    @unittest.skipIf(transforms.has_cupy_edt, "cupy is available")
+    def test_cuda_falls_back_to_cpu(self):
+        with self.assertLogs(transforms.logger.name, level="WARNING"):
+            t = AddRandomGuidanced(device="cuda:0")
+        discrepancy = np.zeros((2, 1, 5, 5, 5), dtype=np.float32)
+        discrepancy[0, 0, 1:4, 1:4, 1:4] = 1
+        t.set_random_state(seed=0)
+        guidance = json.loads(t(_guidance_data(discrepancy))["guidance"])
+        self.assertEqual(guidance[0][-1][1:], [2, 2, 2])
+
+    def test_single_polarity_routing(self):
+        for polarity in (0, 1):
+            discrepancy = np.zeros((2, 1, 5, 5, 5), dtype=np.float32)
+            discrepancy[polarity, 0, 1:4, 1:4, 1:4] = 1
+            # pos_click_probability asks for the other polarity, which has nothing to correct
+            candidates = (AddRandomGuidanced(), PosNegClickProbAddRandomGuidanced(pos_click_probability=polarity))
+            for t in candidates:
+                t.set_random_state(seed=0)
+                result = t(_guidance_data(discrepancy))
+                self.assertEqual(result["is_pos"], polarity == 0)
+                self.assertEqual(result["is_neg"], polarity == 1)
+
+    def test_both_polarities_routing(self):
+        discrepancy = np.zeros((2, 1, 5, 5, 5), dtype=np.float32)
+        discrepancy[0, 0, 0, 0, 0] = 1
+        discrepancy[1, 0, 1:4, 1:4, 1:4] = 1
+        # PosNeg follows pos_click_probability, AddRandom corrects the larger discrepancy
+        t = PosNegClickProbAddRandomGuidanced(pos_click_probability=1.0)
+        t.set_random_state(seed=0)
+        self.assertTrue(t(_guidance_data(discrepancy))["is_pos"])
+        t = AddRandomGuidanced()
+        t.set_random_state(seed=0)
+        self.assertTrue(t(_guidance_data(discrepancy))["is_neg"])
+
+    def test_no_interaction(self):
+        discrepancy = np.stack([LABEL, 1 - LABEL]).astype(np.float32)
+        for t in (AddRandomGuidanced(), PosNegClickProbAddRandomGuidanced()):
+            t.set_random_state(seed=0)
+            result = t(_guidance_data(discrepancy, probability=0.0))
+            self.assertEqual(json.loads(result["guidance"]), [[], []])
+            self.assertFalse(result["is_pos"] or result["is_neg"])
+
+    def test_certain_interaction_keeps_random_state(self):
+        t = AddRandomGuidanced()
+        t.set_random_state(seed=0)
+        t.randomize({"probability": 1.0})
+        self.assertTrue(t._will_interact)
+        self.assertEqual(t.R.random(), np.random.RandomState(0).random())
+
+    def test_sample_click_python_types(self):
+        discrepancy = np.zeros((1, 5, 5, 5), dtype=np.float32)
+        discrepancy[0, 1, 3, 1] = 1
+        click = transforms._sample_click(discrepancy, None, 2, np.random.RandomState(0))
+        self.assertEqual(click, [1.0, 1, 3, 1])
+        self.assertIs(type(click[0]), float)
+        self.assertTrue(all(type(c) is int for c in click[1:]))
+
 
 if __name__ == "__main__":
     unittest.main()